@@ -3,6 +3,7 @@ import torch.nn.functional as F
 import os
 import numpy as np
 import glob
+from concurrent.futures import ThreadPoolExecutor
 
 class PseudoDataset(torch.utils.data.Dataset):
     def __init__(self, args, augment=True):
@@ -114,6 +115,15 @@ class PseudoDataset(torch.utils.data.Dataset):
         gt_dict['idx'] = idx
         return gt_dict
     
+    def get_segs(self, indices):
+        # Gather only the semantic maps for a batch of samples (used by the export
+        # path, which does not need the textures/meshes of __getitem__).
+        # The per-file reads are I/O-bound, so they run on a small thread pool.
+        assert self.args.conditional_semantics
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            segs = list(pool.map(lambda i: self._load_pseudogt(i, train=True)['seg'], indices))
+        return torch.stack(segs, dim=0)
+
     @staticmethod
     def mirror_tex(tr):
         # "Virtually" flip a texture or displacement map of shape (nc, H, W)
@@ -122,7 +132,7 @@ class PseudoDataset(torch.utils.data.Dataset):
         tr = torch.flip(tr, dims=(2,))
         tr = torch.cat((tr, tr), dim=2)
         tr = tr[:, :, tr.shape[2]//4:-tr.shape[2]//4]
-        return tr
+        return tr.contiguous() # So that pinning the batch does not fall back to a copy
     
 
 
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint as cp
 import numpy as np
 
 from rendering.utils import circpad, symmetrize_texture, adjust_poles
@@ -451,6 +452,14 @@ class Generator(nn.Module):
             x = self.fc(z)
             x = x.view(x.shape[0], -1, self.height, self.width)
             
+        if getattr(self.args, 'checkpoint_activations', False) and self.training and torch.is_grad_enabled():
+            # Recompute the deep (high-resolution) texture blocks during the backward
+            # pass instead of keeping their activations alive. Note that their batch-norm
+            # running statistics get updated twice per step, which is harmless in practice.
+            blk = lambda f, *inputs: cp.checkpoint(f, *inputs, use_reentrant=False)
+        else:
+            blk = lambda f, *inputs: f(*inputs)
+
         x = self.up(self.blk1(x, z)) # x2
         x = self.blk2(x, z) # x4
         
@@ -464,19 +473,19 @@ class Generator(nn.Module):
         
         x_tex = x
         if self.args.texture_resolution >= 256:
-            x_tex = self.up(self.blk3a(x_tex, z)) # x8
+            x_tex = self.up(blk(self.blk3a, x_tex, z)) # x8
         if self.args.texture_resolution >= 512:
-            x_tex = self.up(self.blk3b(x_tex, z)) # x16
+            x_tex = self.up(blk(self.blk3b, x_tex, z)) # x16
         if self.args.texture_resolution >= 1024:
-            x_tex = self.up(self.blk3c(x_tex, z)) # x32
-        x_tex = self.up(self.blk4(x_tex, z))
-        x_tex = self.up(self.blk5(x_tex, z))
+            x_tex = self.up(blk(self.blk3c, x_tex, z)) # x32
+        x_tex = self.up(blk(self.blk4, x_tex, z))
+        x_tex = self.up(blk(self.blk5, x_tex, z))
         x_seg = x_tex if self.args.predict_semantics else None
-        x_tex = self.relu(self.blk6(x_tex, z)) # No upscaling
+        x_tex = self.relu(blk(self.blk6, x_tex, z)) # No upscaling
         x_tex = self.conv_final(self.pad(x_tex, 2)).tanh_()
         
         if self.args.predict_semantics:
-            x_seg = self.relu(self.blk6_seg(x_seg, z)) # No upscaling
+            x_seg = self.relu(blk(self.blk6_seg, x_seg, z)) # No upscaling
             x_seg = F.softmax(self.conv_final_seg(self.pad(x_seg, 2))*100, dim=1)
         
         if self.mesh_head:
@@ -31,15 +31,16 @@ def ortho_projection(points_bxpx3, faces_fx3):
 
 class Renderer(nn.Module):
 
-    def __init__(self, height, width, filtering='bilinear', mode='texture'):
+    def __init__(self, height, width, filtering='bilinear', mode='texture', channels_first=False):
         super().__init__()
 
         assert mode in ['texture', 'vc', 'alpha']
-        
+
         self.height = height
         self.width = width
         self.filtering = filtering
         self.mode = mode
+        self.channels_first = channels_first
 
     def forward(self, points, uv_bxpx2, texture_bx3xthxtw, ft_fx3=None, background_image=None, return_hardmask=False, delta=None):
 
@@ -123,4 +124,10 @@ class Renderer(nn.Module):
 
         if return_hardmask:
             improb_bxhxwx1 = hardmask
+        if self.channels_first:
+            # The rasterizer emits NHWC buffers, so these permuted views are already
+            # contiguous in the channels-last memory format (no copy involved)
+            if imrender is not None:
+                imrender = imrender.permute(0, 3, 1, 2)
+            improb_bxhxwx1 = improb_bxhxwx1.permute(0, 3, 1, 2)
         return imrender, improb_bxhxwx1
@@ -8,20 +8,24 @@ import argparse
 import sys
 import time
 import math
-import glob
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import torch.utils.data
+from torch.nn.parallel import DistributedDataParallel
 
 from rendering.mesh_template import MeshTemplate
 from rendering.utils import qrot
 
-from utils.fid import RepeatIterator, calculate_stats, calculate_frechet_distance, init_inception, forward_inception_batch
+from utils.fid import RepeatIterator, PrefetchLoader, OnlineStats, calculate_frechet_distance, \
+                      init_inception, forward_inception_batch
 from utils.losses import GANLoss, loss_flat
 
 from data.pseudo_dataset import PseudoDataset, PseudoDatasetForEvaluation
@@ -66,6 +70,8 @@ parser.add_argument('--mesh_regularization', type=float, default=0.0001, help='s
 parser.add_argument('--lr_g', type=float, default=0.0001)
 parser.add_argument('--lr_d', type=float, default=0.0004)
 parser.add_argument('--d_steps_per_g', type=int, default=2)
+parser.add_argument('--accum_steps', type=int, default=1, help='micro-batches to accumulate per optimizer step')
+parser.add_argument('--checkpoint_activations', action='store_true', help='recompute the deep generator blocks in the backward pass (saves memory at some compute cost)')
 parser.add_argument('--g_running_average_alpha', type=float, default=0.999)
 parser.add_argument('--lr_decay_after', type=int, default=100000) # Set to a very large value to disable
 parser.add_argument('--loss', type=str, default='hinge', help='(hinge|ls|original)')
@@ -124,9 +130,15 @@ if args.predict_semantics:
     args.num_parts = train_ds[0]['seg_inv_rend'].shape[0]
     print(f'Enabled semantics prediction with {args.num_parts} object parts')
     
+# Read early: the --iters conversion below needs the global batch size
+local_rank = int(os.environ.get('LOCAL_RANK', 0))
+world_size = int(os.environ.get('WORLD_SIZE', 1))
+
 if args.iters != -1:
     print('Iterations specified:', args.iters)
-    iters_per_epoch = int(len(train_ds) / args.batch_size)
+    # --batch_size is per process and per micro-batch: each optimizer step
+    # consumes batch_size * world_size * accum_steps samples
+    iters_per_epoch = int(len(train_ds) / (args.batch_size * world_size * args.accum_steps))
     print('Iterations per epoch:', iters_per_epoch)
     args.epochs = int(args.iters / iters_per_epoch)
     args.evaluate_freq = int(args.epochs / 30)
@@ -161,10 +173,6 @@ if args.filter_class is not None and (not args.evaluate or not args.conditional_
     sys.exit(1)
     
         
-if args.norm_g == 'syncbatch':
-    # Import library for synchronized batch normalization
-    from sync_batchnorm import DataParallelWithCallback
-    
 if args.conditional_text:
     from utils.text_functions import RNN_Encoder
     
@@ -175,18 +183,41 @@ if args.tensorboard and not args.evaluate:
     
 gpu_ids = [int(x) for x in args.gpu_ids.split(',')]
 print('Using {} GPUs: {}'.format(len(gpu_ids), gpu_ids))
-torch.cuda.set_device(min(gpu_ids))
-    
+
+# One process per GPU: each process drives a single device and gradients are averaged
+# with DistributedDataParallel, which scales much better than DataParallel.
+if world_size > 1:
+    assert len(gpu_ids) == world_size, 'Expected one entry in --gpu_ids per spawned process'
+    dist.init_process_group(backend='nccl')
+elif len(gpu_ids) > 1:
+    print('Multi-GPU execution uses one process per GPU. Launch with e.g. '
+          f'torchrun --nproc_per_node={len(gpu_ids)} run_generation.py <args>')
+    sys.exit(1)
+device_id = gpu_ids[local_rank]
+is_master = local_rank == 0
+torch.cuda.set_device(device_id)
+
 eval_ds = PseudoDatasetForEvaluation(train_ds)
 
+# Pinned host memory allows the H2D copies to run asynchronously w.r.t. GPU compute
+loader_settings = {
+    'batch_size': args.batch_size,
+    'num_workers': args.num_workers,
+    'pin_memory': True,
+    'persistent_workers': args.num_workers > 0,
+    'prefetch_factor': 4 if args.num_workers > 0 else None,
+}
+
 if args.dataset == 'all':
     print('Balancing dataset.')
-    sampler = torch.utils.data.WeightedRandomSampler(train_ds.image_weights, len(train_ds))
-    train_loader = torch.utils.data.DataLoader(train_ds, batch_size=args.batch_size, num_workers=args.num_workers,
-                                               pin_memory=False, drop_last=True, sampler=sampler)
+    # Weighted sampling draws with replacement, so each process can simply draw its own share
+    sampler = torch.utils.data.WeightedRandomSampler(train_ds.image_weights, len(train_ds) // world_size)
+    train_loader = torch.utils.data.DataLoader(train_ds, drop_last=True, sampler=sampler, **loader_settings)
+elif world_size > 1:
+    train_sampler = torch.utils.data.distributed.DistributedSampler(train_ds)
+    train_loader = torch.utils.data.DataLoader(train_ds, drop_last=True, sampler=train_sampler, **loader_settings)
 else:
-    train_loader = torch.utils.data.DataLoader(train_ds, batch_size=args.batch_size, num_workers=args.num_workers,
-                                               pin_memory=False, drop_last=True, shuffle=True)
+    train_loader = torch.utils.data.DataLoader(train_ds, drop_last=True, shuffle=True, **loader_settings)
 
     
 if args.evaluate and args.filter_class is not None:
@@ -200,8 +231,12 @@ if args.evaluate and args.filter_class is not None:
     print('Overriding cache dir:', cache_dir)
 
 
-eval_loader = torch.utils.data.DataLoader(eval_ds, batch_size=args.batch_size, num_workers=args.num_workers,
-                                          pin_memory=False, shuffle=False)
+if world_size > 1:
+    # Shard the evaluation across processes; the FID statistics are merged afterwards
+    eval_sampler = torch.utils.data.distributed.DistributedSampler(eval_ds, shuffle=False)
+    eval_loader = torch.utils.data.DataLoader(eval_ds, sampler=eval_sampler, **loader_settings)
+else:
+    eval_loader = torch.utils.data.DataLoader(eval_ds, shuffle=False, **loader_settings)
 
 
 if not args.texture_only:
@@ -211,49 +246,81 @@ if not args.texture_only:
 
     mesh_template = MeshTemplate(args.mesh_path, is_symmetric=args.symmetric_g)
 
+    # Axis flip applied to the vertices before rendering. Allocated once and kept
+    # resident on the GPU, instead of a host allocation + copy on every render call.
+    axis_flip = torch.tensor([1., -1., -1.], device='cuda')
+
     # For real-time FID evaluation
     if not args.export_sample:
         evaluation_res = 299 # Same as Inception input resolution
     else:
         evaluation_res = 1024 # For exporting images: higher resolution
-    renderer = Renderer(evaluation_res, evaluation_res)
-    renderer = nn.DataParallel(renderer, gpu_ids)
+    renderer = Renderer(evaluation_res, evaluation_res, channels_first=True)
 
     if not args.export_sample:
-        inception_model = nn.DataParallel(init_inception(), gpu_ids).cuda().eval()
+        # One Inception instance per process; the evaluation set is sharded instead
+        # of scattering/gathering each batch across GPUs
+        inception_model = init_inception().to(memory_format=torch.channels_last).cuda().eval()
 
         # Load precomputed statistics to speed up FID computation
-        stats = np.load(os.path.join(cache_dir, f'precomputed_fid_{evaluation_res}x{evaluation_res}.npz'), allow_pickle=True)
-        m_real_val = stats['stats_m']
-        s_real_val = stats['stats_s'] + np.triu(stats['stats_s'].T, 1)
-        n_images_val = min(stats['num_images'], 50000)
+        with np.load(os.path.join(cache_dir, f'precomputed_fid_{evaluation_res}x{evaluation_res}.npz')) as stats:
+            m_real_val = stats['stats_m']
+            # Only the lower triangle of the (symmetric) covariance is stored on disk:
+            # mirror it in place instead of materializing a second full-size copy
+            s_real_val = stats['stats_s']
+            s_real_val += np.triu(s_real_val.T, 1)
+            n_images_val = min(stats['num_images'], 50000)
+            assert stats['resolution'] == evaluation_res, 'Resolution does not match'
         print(f'Found statistics for FID computation (# images: {n_images_val})')
-        assert stats['resolution'] == evaluation_res, 'Resolution does not match'
-        stats = None
     
 
 
+def truncated_normal(shape, sigma, device=None):
+    """
+    Single-shot sampling from a standard normal truncated to [-sigma, sigma],
+    through the inverse CDF. Unlike rejection sampling, this launches a single
+    kernel and never synchronizes with the host.
+    """
+    max_cdf = 0.5 * (1 + math.erf(sigma / math.sqrt(2)))
+    u = torch.rand(shape, device=device)
+    return math.sqrt(2) * torch.erfinv((2*max_cdf - 1) * (2*u - 1))
+
+
+ix2word_list = None # Vocabulary lookup cached as a flat list for caption logging
+
 def evaluate_fid(writer, it, visualization_indices=None, fast=False):
-    global m_real_val, s_real_val
-    
-    emb_arr_fake_combined = []
-    emb_arr_fake_combined_seg = []
-    emb_arr_fake_texture_only = []
-    emb_arr_fake_mesh_only = []
-    emb_arr_fake_seg_only = []
-    
+    global m_real_val, s_real_val, ix2word_list
+
+    # Streaming accumulators: the Inception embeddings are folded into running
+    # mean/covariance estimates instead of being stored for all 50k images
+    stats_fake_combined = OnlineStats()
+    stats_fake_texture_only = OnlineStats()
+    stats_fake_mesh_only = OnlineStats()
+
     # Grid for visualization
     if visualization_indices is not None:
         indices_to_render = visualization_indices.numpy()
-        shuffle_idx = np.argsort(np.argsort(indices_to_render)) # To restore the original order
+        # Inverse permutation, to restore the original order
+        # (single-pass equivalent of argsort(argsort(x)))
+        order = np.argsort(indices_to_render)
+        shuffle_idx = np.empty_like(order)
+        shuffle_idx[order] = np.arange(len(order))
     else:
         if args.filter_class is None:
             indices_to_render = np.random.choice(len(train_ds), size=16, replace=False)
         else:
             indices_to_render = None
         shuffle_idx = None
-        
-    with torch.no_grad():
+    if world_size > 1 and indices_to_render is not None:
+        # All processes must look for the same visualization samples in their shard
+        obj = [indices_to_render]
+        dist.broadcast_object_list(obj, src=0)
+        indices_to_render = obj[0]
+    indices_to_render_dev = None # Device-resident copy, created lazily inside the loop
+
+    # inference_mode is strictly cheaper than no_grad (no version-counter bookkeeping);
+    # everything produced here ends up on the CPU or in tensorboard, never in autograd
+    with torch.inference_mode():
         generator_running_avg.eval()
 
         sample_real = []
@@ -266,7 +333,8 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
         sample_tex_real = []
         sample_tex_fake = []
         sample_mesh_map_fake = []
-        
+        sample_vis_idx = [] # Dataset indices of the collected samples
+
         if args.evaluate:
             # Deterministic seed, but only in evaluation mode since we do not want to reset
             # the random state while we train the model (it would cripple the model).
@@ -275,13 +343,62 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
         
         num_passes = (n_images_val + len(eval_ds) - 1) // len(eval_ds) # Round up
         print(f'Evaluating FID on {n_images_val} images...')
-        for data in tqdm(RepeatIterator(eval_loader, num_passes)):
-            for k in ['texture', 'mesh', 'translation', 'scale', 'rotation']:
-                if k in data:
-                    data[k] = data[k].cuda()
 
+        # Select up front which of the num_passes*len(eval_ds) generated images
+        # contribute to the statistics, so that their number matches the test set
+        if m_real_val is not None:
+            if world_size > 1:
+                # Each process selects its share of images from its shard of the stream
+                stream_len = num_passes * len(eval_loader.sampler)
+                n_images_local = n_images_val // world_size
+                seed = 1234 + local_rank
+            else:
+                stream_len = num_passes * len(eval_ds)
+                n_images_local = n_images_val
+                seed = 1234
+            if args.evaluate:
+                np.random.seed(seed)
+            val_indices = np.random.choice(stream_len, size=n_images_local, replace=False)
+            val_mask = np.zeros(stream_len, dtype=bool)
+            val_mask[val_indices] = True
+        else:
+            val_mask = None
+        stream_pos = 0 # Position in the stream of generated images
+
+        def to_pinned_cpu(x):
+            # Asynchronous D2H copy into pinned host memory, so that collecting the
+            # visualization samples does not sync the stream on every batch.
+            # A single synchronize() after the loop makes the copies visible.
+            out = torch.empty_like(x, device='cpu', pin_memory=True)
+            out.copy_(x, non_blocking=True)
+            return out
+        # The prefetcher uploads the next batch to the GPU while the current one is being processed
+        for data in tqdm(PrefetchLoader(RepeatIterator(eval_loader, num_passes))):
             has_pseudogt = 'texture' in data and not fast
 
+            batch_len = data['idx'].shape[0]
+            if batch_len < args.batch_size:
+                # Pad the trailing batch up to the full batch size so that every step
+                # runs at a fixed shape: a varying batch dimension forces torch.compile
+                # to re-specialize and rules out CUDA graph capture. The padded rows are
+                # excluded from the statistics (val_sel < batch_len) and from the
+                # visualizations (their idx is set to -1 below).
+                n_pad = args.batch_size - batch_len
+                def pad_rows(v):
+                    if torch.is_tensor(v):
+                        return torch.cat((v, v[:1].expand(n_pad, *v.shape[1:])), dim=0)
+                    elif isinstance(v, (tuple, list)):
+                        return type(v)(pad_rows(x) for x in v)
+                    else:
+                        return v
+                data = {k: pad_rows(v) for k, v in data.items()}
+                data['idx'][batch_len:] = -1
+            if val_mask is not None:
+                val_sel, = np.where(val_mask[stream_pos:stream_pos + batch_len])
+            else:
+                val_sel = None
+            stream_pos += batch_len
+
             if args.conditional_class:
                 c = data['class'].cuda()
                 caption = None
@@ -302,99 +419,112 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
             
             
             
-            noise = torch.randn(data['idx'].shape[0], args.latent_dim)
-            
             # Gaussian truncation trick
-            sigma = args.truncation_sigma
-            while (noise.abs() > sigma).any():
-                # Rejection sampling
-                mask = noise.abs() > sigma
-                noise[mask] = torch.randn_like(noise[mask])
-
-            noise = noise.cuda()
-            
-            if noise.shape[0] % len(gpu_ids) == 0:
-                pred_tex, pred_mesh_map, pred_seg, attn_map = trainer('inference', None, None, C=c, caption=caption, seg=seg, noise=noise)
-            else:
-                # Batch dimension is not divisible by number of GPUs --> pad
-                original_bsz = noise.shape[0]
-                padding_bsz = len(gpu_ids) - (noise.shape[0] % len(gpu_ids))
-                def pad_batch(batch):
-                    return torch.cat((batch, torch.zeros((padding_bsz, *batch.shape[1:]),
-                                                         dtype=batch.dtype).to(batch.device)), dim=0)
-                    
-                noise_pad = pad_batch(noise)
-                if c is not None:
-                    c_pad = pad_batch(c)
-                else:
-                    c_pad = None
-                if caption is not None:
-                    caption_pad = tuple([pad_batch(x) for x in caption])
-                else:
-                    caption_pad = None
-                if seg is not None:
-                    seg_pad = pad_batch(seg)
-                else:
-                    seg_pad = None
+            noise = truncated_normal((data['idx'].shape[0], args.latent_dim), args.truncation_sigma, device='cuda')
 
-                pred_tex, pred_mesh_map, pred_seg, attn_map = trainer('inference', None, None, C=c_pad,
-                                                            caption=caption_pad, seg=seg_pad, noise=noise_pad)
-                
-                # Unpad
-                pred_tex = pred_tex[:original_bsz]
-                pred_mesh_map = pred_mesh_map[:original_bsz]
-                if attn_map is not None:
-                    attn_map = attn_map[:original_bsz]
-                if args.predict_semantics:
-                    pred_seg = pred_seg[:original_bsz]
+            pred_tex, pred_mesh_map, pred_seg, attn_map = trainer('inference', None, None, C=c, caption=caption, seg=seg, noise=noise)
 
-            def render_and_score(input_mesh_map, input_texture, output_array):
+            def transform_vertices(input_mesh_map):
                 vtx = mesh_template.get_vertex_positions(input_mesh_map)
                 vtx = qrot(data['rotation'], data['scale'].unsqueeze(-1)*vtx) + data['translation'].unsqueeze(1)
-                vtx = vtx * torch.Tensor([1, -1, -1]).to(vtx.device)
-
-                image_pred, _ = mesh_template.forward_renderer(renderer, vtx, input_texture, len(gpu_ids))
-                image_pred = image_pred.permute(0, 3, 1, 2)/2 + 0.5
-                
-                emb = forward_inception_batch(inception_model, image_pred)
-                output_array.append(emb)
-                return image_pred # Return images for visualization
+                return vtx * axis_flip
+
+            def render_images(vtx, input_texture):
+                # The image arrives channels-first in channels-last memory layout,
+                # as expected by the Inception model
+                image_pred, _ = mesh_template.forward_renderer(renderer, vtx, input_texture)
+                image_pred.mul_(0.5).add_(0.5) # In place: avoids materializing two intermediate images
+                return image_pred
+
+            # The vertex positions are shared between the FID variants,
+            # so they are only computed once per mesh map
+            vtx_pred = transform_vertices(pred_mesh_map)
+            bs = pred_tex.shape[0]
+            if has_pseudogt:
+                # Render the three FID variants (combined, texture-only, mesh-only) as a
+                # single 3B batch: one rasterizer and one Inception launch sequence
+                # instead of three, which keeps the GPU busy at small eval batch sizes
+                vtx_real = transform_vertices(data['mesh'])
+                images = render_images(torch.cat((vtx_pred, vtx_real, vtx_pred), dim=0),
+                                       torch.cat((pred_tex, pred_tex, data['texture']), dim=0))
+                emb = forward_inception_batch(inception_model, images)
+                out_combined = images[:bs]
+                out_texture_only = images[bs:2*bs]
+                out_mesh_only = images[2*bs:]
+                if val_sel is not None and len(val_sel) > 0:
+                    stats_fake_combined.update(emb[val_sel])
+                    stats_fake_texture_only.update(emb[bs + val_sel])
+                    stats_fake_mesh_only.update(emb[2*bs + val_sel])
+            else:
+                out_combined = render_images(vtx_pred, pred_tex)
+                emb = forward_inception_batch(inception_model, out_combined)
+                if val_sel is not None and len(val_sel) > 0:
+                    stats_fake_combined.update(emb[val_sel])
 
-            out_combined = render_and_score(pred_mesh_map, pred_tex, emb_arr_fake_combined)
-            
             if args.filter_class is not None and indices_to_render is None:
-                indices_to_render = data['idx'].cpu().numpy()[:16]
-            mask, = np.where(np.isin(data['idx'].cpu().numpy(), indices_to_render))
+                indices_to_render = data['idx'][:min(batch_len, 16)].cpu().numpy()
+            if indices_to_render_dev is None:
+                indices_to_render_dev = torch.as_tensor(indices_to_render, device=data['idx'].device)
+            # Select the visualization samples on the GPU, without syncing on data['idx']
+            mask, = torch.where(torch.isin(data['idx'], indices_to_render_dev))
             if len(mask) > 0:
-                sample_fake.append(out_combined[mask].cpu())
-                sample_mesh_map_fake.append(pred_mesh_map[mask].cpu())
-                sample_tex_fake.append(pred_tex[mask].cpu())
+                sample_fake.append(to_pinned_cpu(out_combined[mask]))
+                sample_mesh_map_fake.append(to_pinned_cpu(pred_mesh_map[mask]))
+                sample_tex_fake.append(to_pinned_cpu(pred_tex[mask]))
+                sample_vis_idx.append(to_pinned_cpu(data['idx'][mask]))
                 if has_pseudogt:
-                    sample_real.append(data['image'][mask])
-                    sample_tex_real.append(data['texture'][mask].cpu())
+                    sample_real.append(to_pinned_cpu(data['image'][mask]))
+                    sample_tex_real.append(to_pinned_cpu(data['texture'][mask]))
                 if args.conditional_text:
-                    sample_text.append(caption[0][mask].cpu())
-                if args.conditional_semantics: 
-                    sample_seg.append(seg[mask].cpu())
+                    sample_text.append(to_pinned_cpu(caption[0][mask]))
+                if args.conditional_semantics:
+                    sample_seg.append(to_pinned_cpu(seg[mask]))
                 #elif args.predict_semantics:
                 #    sample_seg_fake.append(pred_seg[mask].cpu())
                 #    raise NotImplemented
                     
                 
-            if has_pseudogt:
-                out_combined = render_and_score(data['mesh'], pred_tex, emb_arr_fake_texture_only)
-                if len(mask) > 0:
-                    sample_fake_texture_only.append(out_combined[mask].cpu())
-                out_combined = render_and_score(pred_mesh_map, data['texture'], emb_arr_fake_mesh_only)
-                if len(mask) > 0:
-                    sample_fake_mesh_only.append(out_combined[mask].cpu())
-                
-    emb_arr_fake_combined = np.concatenate(emb_arr_fake_combined, axis=0)
+            if has_pseudogt and len(mask) > 0:
+                sample_fake_texture_only.append(to_pinned_cpu(out_texture_only[mask]))
+                sample_fake_mesh_only.append(to_pinned_cpu(out_mesh_only[mask]))
+
+    torch.cuda.synchronize() # Wait for the asynchronous sample copies issued above
+
+    if world_size > 1:
+        # Each process has only seen its shard of the evaluation set:
+        # merge the FID statistics and gather the (small) visualization samples
+        def gather_lists(lst):
+            out = [None] * world_size
+            dist.all_gather_object(out, lst)
+            return [x for rank_list in out for x in rank_list]
+
+        def merge_stats(local_stats):
+            merged = OnlineStats()
+            for shard in gather_lists([local_stats]):
+                merged.merge(shard)
+            return merged
+
+        stats_fake_combined = merge_stats(stats_fake_combined)
+        sample_fake = gather_lists(sample_fake)
+        sample_mesh_map_fake = gather_lists(sample_mesh_map_fake)
+        sample_tex_fake = gather_lists(sample_tex_fake)
+        sample_vis_idx = gather_lists(sample_vis_idx)
+        if has_pseudogt:
+            stats_fake_texture_only = merge_stats(stats_fake_texture_only)
+            stats_fake_mesh_only = merge_stats(stats_fake_mesh_only)
+            sample_real = gather_lists(sample_real)
+            sample_fake_texture_only = gather_lists(sample_fake_texture_only)
+            sample_fake_mesh_only = gather_lists(sample_fake_mesh_only)
+            sample_tex_real = gather_lists(sample_tex_real)
+        if args.conditional_text:
+            sample_text = gather_lists(sample_text)
+        if args.conditional_semantics:
+            sample_seg = gather_lists(sample_seg)
+
     if has_pseudogt:
-        emb_arr_fake_texture_only = np.concatenate(emb_arr_fake_texture_only, axis=0)
-        emb_arr_fake_mesh_only = np.concatenate(emb_arr_fake_mesh_only, axis=0)
         sample_real = torch.cat(sample_real, dim=0)
     sample_fake = torch.cat(sample_fake, dim=0)
+    sample_vis_idx = torch.cat(sample_vis_idx, dim=0)
     sample_mesh_map_fake = torch.cat(sample_mesh_map_fake, dim=0)
     sample_tex_fake = torch.cat(sample_tex_fake, dim=0)
     if has_pseudogt:
@@ -410,6 +540,14 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
     #    raise NotImplemented
         
     if shuffle_idx is not None:
+        if world_size > 1:
+            # The gathered shards are grouped by rank and may contain duplicates
+            # (RepeatIterator re-scans the eval set when n_images_val exceeds it,
+            # and DistributedSampler pads the last batch); shuffle_idx expects one
+            # sample per dataset index, so keep the first occurrence of each index
+            # and compose with the resulting (sorted) permutation
+            _, first_occurrence = np.unique(sample_vis_idx.numpy(), return_index=True)
+            shuffle_idx = first_occurrence[shuffle_idx]
         sample_fake = sample_fake[shuffle_idx]
         sample_mesh_map_fake = sample_mesh_map_fake[shuffle_idx]
         sample_tex_fake = sample_tex_fake[shuffle_idx]
@@ -427,25 +565,20 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
         #    raise NotImplemented
 
     if m_real_val is not None:
-        # Make sure the number of images is the same as that of the test set
-        if args.evaluate:
-            np.random.seed(1234)
-        val_indices = np.random.choice(len(emb_arr_fake_combined), size=n_images_val, replace=False)
-        
-        m1_val, s1_val = calculate_stats(emb_arr_fake_combined[val_indices])
+        m1_val, s1_val = stats_fake_combined.get_stats()
         fid_val = calculate_frechet_distance(m1_val, s1_val, m_real_val, s_real_val)
         log('FID: {:.02f}'.format(fid_val))
 
         if has_pseudogt:
-            m2_val, s2_val = calculate_stats(emb_arr_fake_texture_only[val_indices])
+            m2_val, s2_val = stats_fake_texture_only.get_stats()
             fid_texture_val = calculate_frechet_distance(m2_val, s2_val, m_real_val, s_real_val)
             log('Texture-only FID: {:.02f}'.format(fid_texture_val))
 
-            m3_val, s3_val = calculate_stats(emb_arr_fake_mesh_only[val_indices])
+            m3_val, s3_val = stats_fake_mesh_only.get_stats()
             fid_mesh_val = calculate_frechet_distance(m3_val, s3_val, m_real_val, s_real_val)
             log('Mesh-only FID: {:.02f}'.format(fid_mesh_val))
     
-    if args.tensorboard and not args.evaluate:
+    if writer is not None: # Tensorboard visualization (only on the master process)
         writer.add_image('image/real_tex', to_grid_tex(sample_tex_real), it)
         writer.add_image('image/fake_tex', to_grid_tex(sample_tex_fake), it)
         writer.add_image('image/fake_mesh', to_grid_mesh(sample_mesh_map_fake), it)
@@ -460,18 +593,19 @@ def evaluate_fid(writer, it, visualization_indices=None, fast=False):
         writer.add_image('render/real', grid_real, it)
         
         if args.conditional_text:
-            full_text = ''
-            for idx, text in enumerate(sample_text):
-                full_text += f'{idx}. '
+            if ix2word_list is None:
+                ixtoword = train_ds.text_processor.ixtoword
+                ix2word_list = [ixtoword.get(i, '') for i in range(max(ixtoword) + 1)]
+            lines = []
+            for idx, text in enumerate(sample_text.tolist()): # A single sync for all captions
+                words = []
                 for wi in text:
-                    wi = wi.item()
                     if wi == 0:
                         # Padding token
                         break
-                    else:
-                        full_text += train_ds.text_processor.ixtoword[wi] + ' '
-                full_text += '  \n'
-            writer.add_text('render/caption', full_text, it)
+                    words.append(ix2word_list[wi])
+                lines.append(f'{idx}. ' + ' '.join(words) + '  \n')
+            writer.add_text('render/caption', ''.join(lines), it)
         
         if args.conditional_semantics:
             grid_seg = torchvision.utils.make_grid(sample_seg.data[:, :3], nrow=4)
@@ -506,7 +640,7 @@ def divide_pred(pred):
 
 
 def update_generator_running_avg(epoch):
-    with torch.no_grad():
+    with torch.inference_mode():
         # This heuristic does not affect the final result, it is just done for visualization purposes.
         # If alpha is very high (e.g. 0.999) it may take a while to visualize correct results on TensorBoard,
         # (or estimate reliable FID scores), therefore we lower alpha for the first few epochs.
@@ -516,12 +650,12 @@ def update_generator_running_avg(epoch):
             alpha = math.pow(args.g_running_average_alpha, 10)
         else:
             alpha = args.g_running_average_alpha
-        g_state_dict = generator.state_dict()
-        for k, param in generator_running_avg.state_dict().items():
-            if torch.is_floating_point(param):
-                param.mul_(alpha).add_(g_state_dict[k], alpha=1-alpha)
-            else:
-                param.fill_(g_state_dict[k])
+        avg_float, g_float, non_float = ema_tensors
+        # Multi-tensor EMA update: two kernel launches instead of two per parameter
+        torch._foreach_mul_(avg_float, alpha)
+        torch._foreach_add_(avg_float, g_float, alpha=1-alpha)
+        for param, src in non_float:
+            param.fill_(src)
 
 class ModelWrapper(nn.Module):
     
@@ -550,7 +684,8 @@ class ModelWrapper(nn.Module):
                     # Different instances for G and D
                     self.text_encoder_d = text_encoder_instantiator()
         
-    def forward(self, mode, X_tex, X_alpha, X_mesh=None, C=None, caption=None, seg=None, noise=None):
+    def forward(self, mode, X_tex, X_alpha, X_mesh=None, C=None, caption=None, seg=None, noise=None,
+                fakes_override=None):
         assert mode in ['g', 'd', 'inference']
         if noise is None:
             noise = torch.randn((X_alpha.shape[0], args.latent_dim), device=X_alpha.device)
@@ -584,22 +719,36 @@ class ModelWrapper(nn.Module):
         elif mode == 'd':
             # D mode
             with torch.no_grad():
-                pred_tex, pred_mesh, pred_seg = self.generator(noise, C, caption, seg)
-                X_fake = torch.cat((pred_tex * X_alpha, X_alpha), dim=1) # Mask output
+                if fakes_override is not None:
+                    # Fakes cached right after the last G update: every D step of the
+                    # window reuses them instead of re-running the generator
+                    pred_tex, pred_mesh, pred_seg = fakes_override
+                else:
+                    pred_tex, pred_mesh, pred_seg = self.generator(noise, C, caption, seg)
                 X_fake_mesh = pred_mesh
-                X_seg_fake = torch.cat((pred_seg * X_alpha, X_alpha), dim=1) # Mask output
-                
-                X_real = torch.cat((X_tex, X_alpha), dim=1)
+
                 assert (X_mesh is None) == (pred_mesh is None)
-                X_combined = torch.cat((X_fake, X_real), dim=0)
+                # Assemble the fake/real D input directly into its final (2B, C+1, H, W)
+                # buffer instead of chaining torch.cat calls, which would copy every
+                # intermediate (masked fake, masked real, concatenation) one extra time
+                bs, nc = pred_tex.shape[:2]
+                X_combined = pred_tex.new_empty((2*bs, nc + 1, *pred_tex.shape[2:]))
+                torch.mul(pred_tex, X_alpha, out=X_combined[:bs, :nc]) # Mask output
+                X_combined[:bs, nc:].copy_(X_alpha)
+                X_combined[bs:, :nc].copy_(X_tex)
+                X_combined[bs:, nc:].copy_(X_alpha)
                 C_combined = torch.cat((C, C), dim=0) if C is not None else None
                 caption_combined = [torch.cat((x, x), dim=0) for x in caption] if caption is not None else None
-                
+
                 if args.predict_semantics:
                     assert seg is not None
-                    X_seg_real = torch.cat((seg * X_alpha, X_alpha), dim=1)
-                    seg_combined = torch.cat((X_seg_fake, X_seg_real), dim=0)
-                    
+                    nc_seg = pred_seg.shape[1]
+                    seg_combined = pred_seg.new_empty((2*bs, nc_seg + 1, *pred_seg.shape[2:]))
+                    torch.mul(pred_seg, X_alpha, out=seg_combined[:bs, :nc_seg]) # Mask output
+                    seg_combined[:bs, nc_seg:].copy_(X_alpha)
+                    torch.mul(seg, X_alpha, out=seg_combined[bs:, :nc_seg])
+                    seg_combined[bs:, nc_seg:].copy_(X_alpha)
+
                 else:
                     seg_combined = torch.cat((seg, seg), dim=0) if seg is not None else None
                 
@@ -624,18 +773,12 @@ class ModelWrapper(nn.Module):
         
         else:
             # Inference mode
-            with torch.no_grad():
+            with torch.inference_mode():
                 pred_tex, pred_mesh, pred_seg, attn_map,  = self.generator_running_avg(noise, C, caption, seg, return_attention=True)
             return pred_tex, pred_mesh, pred_seg, attn_map
 
 
 
-if args.norm_g == 'syncbatch':
-    dataparallel = DataParallelWithCallback
-    print('Using SyncBN')
-else:
-    dataparallel = nn.DataParallel
-
 use_mesh = not args.texture_only
 
 if args.conditional_text:
@@ -644,21 +787,75 @@ if args.conditional_text:
 else:
     text_encoder_instantiator = None
     
-trainer = dataparallel(ModelWrapper(
+trainer = ModelWrapper(
     lambda: Generator(args, args.latent_dim, symmetric=args.symmetric_g, mesh_head=use_mesh),
     MultiScaleDiscriminator(args, 4) if not args.evaluate else None,
     text_encoder_instantiator,
-).cuda(), gpu_ids)
+).cuda()
+
+if args.norm_g == 'syncbatch' and world_size > 1:
+    # Convert the SynchronizedBatchNorm2d layers (designed for DataParallel)
+    # to native SyncBatchNorm, which synchronizes across DDP processes
+    trainer = nn.SyncBatchNorm.convert_sync_batchnorm(trainer)
+    print('Using SyncBN')
 
-generator = trainer.module.generator
-generator_running_avg = trainer.module.generator_running_avg
-discriminator = trainer.module.discriminator
+# Keep eager references for the optimizers, the EMA update and checkpoint I/O:
+# torch.compile below swaps in a compiled forward but shares the parameters, and
+# the eager state_dict avoids the _orig_mod. key prefix in saved checkpoints
+generator = trainer.generator
+generator_running_avg = trainer.generator_running_avg
+discriminator = trainer.discriminator
+
+def build_ema_tensors():
+    # Pair up the EMA and live tensors once: both models (and any checkpoint load)
+    # update these tensors in place, so the references stay valid for the whole run
+    g_state_dict = generator.state_dict()
+    avg_float, g_float, non_float = [], [], []
+    for k, param in generator_running_avg.state_dict().items():
+        if torch.is_floating_point(param):
+            avg_float.append(param)
+            g_float.append(g_state_dict[k])
+        else:
+            non_float.append((param, g_state_dict[k]))
+    return avg_float, g_float, non_float
+
+ema_tensors = build_ema_tensors()
+
+if hasattr(torch, 'compile') and not args.evaluate:
+    # Compile the training-time G and D forwards before the DDP wrap, so that the
+    # gradient-bucketing hooks are installed on the compiled modules.
+    # fullgraph=False lets unsupported ops break the graph and run eagerly.
+    try:
+        trainer.generator = torch.compile(trainer.generator, mode='reduce-overhead', fullgraph=False)
+        trainer.discriminator = torch.compile(trainer.discriminator, mode='reduce-overhead', fullgraph=False)
+    except Exception as e:
+        print(f'torch.compile unavailable, training in eager mode ({e})')
+        trainer.generator = generator
+        trainer.discriminator = discriminator
+
+trainer_module = trainer
+if world_size > 1 and not args.evaluate:
+    # find_unused_parameters is needed because each forward pass runs either G or D, never both
+    trainer = DistributedDataParallel(trainer, device_ids=[device_id], output_device=device_id,
+                                      broadcast_buffers=False, find_unused_parameters=True)
+
+if hasattr(torch, 'compile') and not args.texture_only:
+    # The inference pipeline (EMA generator -> renderer -> Inception) runs with static
+    # shapes per evaluation_res, which makes it a good torch.compile target.
+    # fullgraph=False lets unsupported ops (e.g. the kaolin rasterizer) fall back to eager.
+    # Note that the global generator_running_avg above keeps referencing the eager module,
+    # so the EMA update and checkpoint loading are unaffected (the parameters are shared).
+    trainer_module.generator_running_avg = torch.compile(trainer_module.generator_running_avg,
+                                                         mode='reduce-overhead', fullgraph=False)
+    renderer = torch.compile(renderer, mode='reduce-overhead', fullgraph=False)
+    if not args.export_sample:
+        inception_model = torch.compile(inception_model, mode='reduce-overhead', fullgraph=False)
 
 
 if args.conditional_text:
-    text_encoder_g = trainer.module.text_encoder_g
+    text_encoder_g = trainer_module.text_encoder_g
     if not args.evaluate:
-        text_encoder_d = trainer.module.text_encoder_d
+        text_encoder_d = trainer_module.text_encoder_d
     if len(args.text_pretrained_encoder) > 0 and not args.evaluate:
         state_dict = torch.load(args.text_pretrained_encoder, map_location=lambda storage, loc: storage)
         text_encoder_g.load_state_dict(state_dict)
@@ -676,6 +873,12 @@ if args.conditional_text:
         text_encoder_g.eval()
         if args.text_train_encoder:
             text_encoder_d.eval()
+        if hasattr(torch, 'compile'):
+            # Inference-only graph with static shapes: compile it like the EMA
+            # generator above. The global text_encoder_g stays eager for
+            # load_state_dict (shared parameters).
+            trainer_module.text_encoder_g = torch.compile(trainer_module.text_encoder_g,
+                                                          mode='reduce-overhead', fullgraph=False)
 
     if args.text_train_encoder:
         g_parameters = list(generator.parameters()) + list(text_encoder_g.parameters())
@@ -691,6 +894,23 @@ elif not args.evaluate:
 if not args.evaluate:
     optimizer_g = optim.Adam(g_parameters, lr=args.lr_g, betas=(0, 0.99))
     optimizer_d = optim.Adam(d_parameters, lr=args.lr_d, betas=(0, 0.99))
+    # Mixed-precision training: one loss scaler per optimizer, since the G and D
+    # steps backpropagate through different graphs
+    scaler_g = torch.cuda.amp.GradScaler()
+    scaler_d = torch.cuda.amp.GradScaler()
+    # Linear decay to zero after args.lr_decay_after, as a LambdaLR so that the
+    # decay state travels with the checkpoint instead of being recomputed ad hoc
+    lr_lambda = lambda e: 1 - min(max((e - args.lr_decay_after)/max(1, args.epochs - args.lr_decay_after), 0), 1)
+    scheduler_g = optim.lr_scheduler.LambdaLR(optimizer_g, lr_lambda)
+    scheduler_d = optim.lr_scheduler.LambdaLR(optimizer_d, lr_lambda)
+    # Materialized parameter lists for the per-step requires_grad toggling in the
+    # training loop (the g_parameters/d_parameters iterators are consumed by Adam)
+    g_param_list = [p for group in optimizer_g.param_groups for p in group['params']]
+    d_param_list = [p for group in optimizer_d.param_groups for p in group['params']]
+
+def set_requires_grad(params, value):
+    for p in params:
+        p.requires_grad_(value)
 
 d_fake_curve = [0]
 d_real_curve = [0]
@@ -726,6 +946,20 @@ if args.continue_train or args.evaluate:
         optimizer_g.load_state_dict(chk['optimizer_g'])
         discriminator.load_state_dict(chk['discriminator'])
         optimizer_d.load_state_dict(chk['optimizer_d'])
+        if 'scaler_g' in chk: # Checkpoints from before mixed precision lack the scalers
+            scaler_g.load_state_dict(chk['scaler_g'])
+            scaler_d.load_state_dict(chk['scaler_d'])
+        if 'scheduler_g' in chk:
+            scheduler_g.load_state_dict(chk['scheduler_g'])
+            scheduler_d.load_state_dict(chk['scheduler_d'])
+        else:
+            # Legacy checkpoint without scheduler state: fast-forward the fresh
+            # schedulers to the resume epoch, otherwise the first step() would
+            # snap the LR back to the start of the decay ramp
+            scheduler_g.last_epoch = epoch
+            scheduler_d.last_epoch = epoch
+            for pg in optimizer_g.param_groups + optimizer_d.param_groups:
+                pg['lr'] = pg['initial_lr'] * lr_lambda(epoch)
         if args.conditional_text and args.text_train_encoder:
             text_encoder_d.load_state_dict(chk['text_encoder_d'])
         
@@ -736,15 +970,15 @@ if args.continue_train or args.evaluate:
         args.epochs = -1 # Disable training
     chk = None
 
-if args.tensorboard and not args.evaluate:
+if args.tensorboard and is_master and not args.evaluate:
     log_dir = 'tensorboard_gan/' + args.name
     if not args.continue_train:
         shutil.rmtree(log_dir, ignore_errors=True) # Delete logs
     writer = SummaryWriter(log_dir)
 else:
     writer = None
-    
-if not args.evaluate:
+
+if not args.evaluate and is_master:
     pathlib.Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
     log_file = open(os.path.join(checkpoint_dir, 'log.txt'), 'a' if args.continue_train else 'w', buffering=1) # Line buffering
     print(' '.join(sys.argv), file=log_file)
@@ -752,118 +986,228 @@ else:
     log_file = None
 
 def log(text):
+    # Only the master process logs; the other ranks would print the same thing
+    if not is_master:
+        return
     if log_file is not None:
         print(text, file=log_file)
     print(text)
 
 
 def to_grid_tex(x):
-    with torch.no_grad():
+    with torch.inference_mode():
         return torchvision.utils.make_grid((x.data[:, :3]+1)/2, nrow=4)
 
 def to_grid_mesh(x):
-    with torch.no_grad():
+    with torch.inference_mode():
         x = x.data[:, :3]
-        minv = x.min(dim=3, keepdim=True)[0].min(dim=2, keepdim=True)[0]
-        maxv = x.max(dim=3, keepdim=True)[0].max(dim=2, keepdim=True)[0]
+        # Single-pass reductions over both spatial dims (the chained per-dim
+        # min/max launched four kernels and materialized the intermediates)
+        minv = x.amin(dim=(2, 3), keepdim=True)
+        maxv = x.amax(dim=(2, 3), keepdim=True)
         x = (x - minv)/(maxv-minv)
         return torchvision.utils.make_grid(x, nrow=4)
 
+# The slow half of checkpointing (serialization + disk write) runs on a single
+# background thread, so a save no longer stalls the start of the next epoch
+checkpoint_pool = ThreadPoolExecutor(max_workers=1)
+checkpoint_future = None
+
+def snapshot_state(obj):
+    # Copy all tensors to host memory on the calling thread: the background
+    # writer must not read tensors that the training loop keeps updating in place
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return {k: snapshot_state(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_state(v) for v in obj)
+    else:
+        return obj
+
+def write_checkpoint(out_dict, path):
+    tmp_path = path + '.tmp'
+    torch.save(out_dict, tmp_path)
+    os.replace(tmp_path, path) # Atomic rename: never leaves a partial checkpoint behind
+
+# Caching fakes across a D-step window is only sound when the generator takes no
+# conditioning input, i.e. when the fakes depend on nothing but the latent code
+cache_fakes = not (args.conditional_class or args.conditional_text
+                   or args.conditional_semantics or args.predict_semantics)
+cached_fakes = None
+
+normal_stream = torch.cuda.Stream() # Side stream for the mesh-flatness regularizer
+
+pending_curves = [] # (curve list, detached GPU scalar)
+pending_scalars = [] # (tensorboard tag, detached GPU scalar, iteration)
+
+def flush_pending():
+    # Materialize all queued loss scalars with a single host sync, instead of
+    # stalling the GPU on a .item() call for each of them every iteration
+    if len(pending_curves) == 0 and len(pending_scalars) == 0:
+        return
+    vals = torch.stack([v for _, v in pending_curves]
+                       + [v for _, v, _ in pending_scalars]).cpu().tolist()
+    for (curve, _), val in zip(pending_curves, vals):
+        curve.append(val)
+    for (tag, _, step), val in zip(pending_scalars, vals[len(pending_curves):]):
+        writer.add_scalar(tag, val, step)
+    pending_curves.clear()
+    pending_scalars.clear()
+
 try:
     while epoch < args.epochs:
         trainer.train()
+        if world_size > 1 and args.dataset != 'all':
+            # Re-seed the sampler, otherwise every epoch shuffles the shards identically
+            train_loader.sampler.set_epoch(epoch)
         start_time = time.time()
-        for i, data in enumerate(train_loader):
-            X_tex = data['texture'].cuda()
-            X_alpha = data['texture_alpha'].cuda()
-            
-            if args.conditional_class:
-                C = data['class'].cuda()
-                caption = None
-            elif args.conditional_text:
-                C = None
-                caption = tuple([x.cuda() for x in data['caption']])
+        # The prefetcher uploads the next batch on a side stream while the current
+        # one is still training, so the H2D copies overlap with the backward pass
+        batch_iter = iter(PrefetchLoader(train_loader))
+        steps_per_epoch = len(train_loader) // args.accum_steps
+        for i in range(steps_per_epoch):
+            g_step = total_it % (1 + args.d_steps_per_g) == 0
+            # Only the side being updated needs parameter gradients: freezing the other
+            # one skips its weight-gradient kernels (input gradients still flow through
+            # the discriminator to reach the generator on G steps)
+            set_requires_grad(g_param_list, g_step)
+            set_requires_grad(d_param_list, not g_step)
+            if g_step:
+                # set_to_none drops the gradient tensors instead of zeroing them,
+                # saving a full write over the parameter memory per step
+                optimizer_g.zero_grad(set_to_none=True)
             else:
-                C, caption = None, None
-                
-            if args.conditional_semantics:
-                seg = data['seg'].cuda()
-            
-            elif args.predict_semantics:
-                seg = data['seg_inv_rend'].cuda()
-            
-            else:
-                seg = None
+                optimizer_d.zero_grad(set_to_none=True)
+
+            for accum_step in range(args.accum_steps):
+                data = next(batch_iter)
+                last_micro_batch = accum_step == args.accum_steps - 1
+                X_tex = data['texture']
+                X_alpha = data['texture_alpha']
+
+                if args.conditional_class:
+                    C = data['class']
+                    caption = None
+                elif args.conditional_text:
+                    C = None
+                    caption = tuple(data['caption'])
+                else:
+                    C, caption = None, None
+
+                if args.conditional_semantics:
+                    seg = data['seg']
+
+                elif args.predict_semantics:
+                    seg = data['seg_inv_rend']
+
+                else:
+                    seg = None
 
-            
-            if use_mesh:
-                X_mesh = data['mesh'].cuda()
-            else:
-                X_mesh = None
 
-            if total_it % (1 + args.d_steps_per_g) == 0:
-                # --------------------------------------------- Generator loop
-                optimizer_g.zero_grad()
-                
-                loss, pred_tex, pred_mesh, pred_seg = trainer('g', None, X_alpha, None, C, caption, seg)
-                
                 if use_mesh:
-                    vtx = mesh_template.get_vertex_positions(pred_mesh)
-                    flat_loss = loss_flat(mesh_template.mesh, mesh_template.compute_normals(vtx))
-                    flat_curve.append(flat_loss.item())
+                    X_mesh = data['mesh']
                 else:
-                    flat_loss = 0
+                    X_mesh = None
+
+                if world_size > 1 and not last_micro_batch:
+                    # Skip the gradient all-reduce on all but the last micro-batch
+                    sync_ctx = trainer.no_sync()
+                else:
+                    sync_ctx = contextlib.nullcontext()
+
+                if g_step:
+                    # --------------------------------------------- Generator loop
+                    with torch.autocast('cuda', dtype=torch.float16):
+                        loss, pred_tex, pred_mesh, pred_seg = trainer('g', None, X_alpha, None, C, caption, seg)
 
-                loss_gan = loss.mean()
-                loss = loss_gan + args.mesh_regularization*flat_loss
-                loss.backward()
-                optimizer_g.step()
-                update_generator_running_avg(epoch)
-                g_curve.append(loss_gan.item())
-                if args.tensorboard:
-                    writer.add_scalar(f'gan_{args.loss}/g', loss_gan.item(), total_it)
                     if use_mesh:
-                        writer.add_scalar('flat', flat_loss.item(), total_it)
-                        
+                        # The flatness regularizer (cross products + normalizations) is
+                        # numerically sensitive, so it stays in full precision. Its many
+                        # small latency-bound kernels are issued on a side stream, so they
+                        # overlap with the tail of the generator forward on the main one
+                        normal_stream.wait_stream(torch.cuda.current_stream())
+                        with torch.cuda.stream(normal_stream):
+                            vtx = mesh_template.get_vertex_positions(pred_mesh.float())
+                            flat_loss = loss_flat(mesh_template.mesh, mesh_template.compute_normals(vtx))
+                        torch.cuda.current_stream().wait_stream(normal_stream)
+                        if last_micro_batch:
+                            pending_curves.append((flat_curve, flat_loss.detach()))
+                    else:
+                        flat_loss = 0
+
+                    loss_gan = loss.mean()
+                    loss = (loss_gan + args.mesh_regularization*flat_loss) / args.accum_steps
+                    with sync_ctx:
+                        scaler_g.scale(loss).backward()
+                    if last_micro_batch:
+                        pending_curves.append((g_curve, loss_gan.detach()))
+                        if writer is not None:
+                            pending_scalars.append((f'gan_{args.loss}/g', loss_gan.detach(), total_it))
+                            if use_mesh:
+                                pending_scalars.append(('flat', flat_loss.detach(), total_it))
+
+                else:
+                    # --------------------------------- Discriminator loop
+                    with torch.autocast('cuda', dtype=torch.float16):
+                        loss_fake, loss_real, pred_tex, pred_mesh, pred_seg = trainer('d', X_tex, X_alpha, X_mesh, C, caption, seg,
+                                                                                      fakes_override=cached_fakes)
+                    loss_fake = loss_fake.mean()
+                    loss_real = loss_real.mean()
+                    loss = (loss_fake + loss_real) / args.accum_steps
+                    with sync_ctx:
+                        scaler_d.scale(loss).backward()
+                    if last_micro_batch:
+                        pending_curves.append((d_fake_curve, loss_fake.detach()))
+                        pending_curves.append((d_real_curve, loss_real.detach()))
+                        if writer is not None:
+                            pending_scalars.append((f'gan_{args.loss}/d_fake_loss', loss_fake.detach(), total_it))
+                            pending_scalars.append((f'gan_{args.loss}/d_real_loss', loss_real.detach(), total_it))
+
+            if g_step:
+                scaler_g.step(optimizer_g)
+                scaler_g.update()
+                update_generator_running_avg(epoch)
+                if cache_fakes and args.d_steps_per_g > 0:
+                    # Draw the fakes for the upcoming D steps once, with the freshly
+                    # updated weights; the D steps of this window then skip their
+                    # internal generator forward (saves d_steps_per_g - 1 G passes)
+                    with torch.no_grad(), torch.autocast('cuda', dtype=torch.float16):
+                        noise_d = torch.randn((X_alpha.shape[0], args.latent_dim), device=X_alpha.device)
+                        cached_fakes = trainer_module.generator(noise_d)
             else:
-                # --------------------------------- Discriminator loop
-                optimizer_d.zero_grad()
-
-                loss_fake, loss_real, pred_tex, pred_mesh, pred_seg = trainer('d', X_tex, X_alpha, X_mesh, C, caption, seg)
-                loss_fake = loss_fake.mean()
-                loss_real = loss_real.mean()
-                loss = loss_fake + loss_real
-                loss.backward()
-                optimizer_d.step()
-                d_fake_curve.append(loss_fake.item())
-                d_real_curve.append(loss_real.item())
-                if args.tensorboard:
-                    writer.add_scalar(f'gan_{args.loss}/d_fake_loss', loss_fake.item(), total_it)
-                    writer.add_scalar(f'gan_{args.loss}/d_real_loss', loss_real.item(), total_it)
+                scaler_d.step(optimizer_d)
+                scaler_d.update()
 
             if total_it % 10 == 0:
+                flush_pending()
                 log('[{}] epoch {}, {}/{}, g_loss {:.5f} d_fake_loss {:.5f} d_real_loss {:.5f} flat {:.5f}'.format(
-                                                                        total_it, epoch, i, len(train_loader),
+                                                                        total_it, epoch, i, steps_per_epoch,
                                                                         g_curve[-1], d_fake_curve[-1], d_real_curve[-1],
                                                                         flat_curve[-1]))
-            
+
             total_it += 1
         
         epoch += 1
-        
+
+        flush_pending() # The checkpoints below store the loss curves
         log('Time per epoch: {:.3f} s'.format(time.time() - start_time))
 
-        if epoch >= args.lr_decay_after and epoch < args.epochs:
-            factor = 1 - min(max((epoch - args.lr_decay_after)/(args.epochs - args.lr_decay_after), 0), 1)
-            for param_group in optimizer_g.param_groups:
-                param_group['lr'] = args.lr_g * factor
-            for param_group in optimizer_d.param_groups:
-                param_group['lr'] = args.lr_d * factor
-                
+        scheduler_g.step()
+        scheduler_d.step()
+
+
         def save_checkpoint(it):
+            global checkpoint_future
+            if not is_master:
+                return
             out_dict = {
                 'optimizer_g': optimizer_g.state_dict(),
                 'optimizer_d': optimizer_d.state_dict(),
+                'scaler_g': scaler_g.state_dict(),
+                'scaler_d': scaler_d.state_dict(),
+                'scheduler_g': scheduler_g.state_dict(),
+                'scheduler_d': scheduler_d.state_dict(),
                 'generator': generator.state_dict(),
                 'generator_running_avg': generator_running_avg.state_dict(),
                 'discriminator': discriminator.state_dict(),
@@ -881,41 +1225,43 @@ try:
                 else:
                     out_dict['text_encoder_g'] = text_encoder_g.state_dict()
                     out_dict['text_encoder_d'] = text_encoder_d.state_dict()
-            torch.save(out_dict, os.path.join(checkpoint_dir, f'checkpoint_{it}.pth'))
+            if checkpoint_future is not None:
+                checkpoint_future.result() # At most one save in flight (and surface its errors)
+            checkpoint_future = checkpoint_pool.submit(write_checkpoint, snapshot_state(out_dict),
+                                                       os.path.join(checkpoint_dir, f'checkpoint_{it}.pth'))
     
         if epoch % args.save_freq == 0:
             save_checkpoint('latest')
         if epoch % args.checkpoint_freq == 0:
             save_checkpoint(str(epoch))
         if epoch % args.evaluate_freq == 0 and not args.texture_only:
-            evaluate_fid(writer, total_it, data['idx'])
+            # All processes take part in the evaluation (the eval set is sharded)
+            evaluate_fid(writer, total_it, data['idx'].cpu())
         
 except KeyboardInterrupt:
     print('Aborted.')
     
 if not args.evaluate:
+    flush_pending()
     save_checkpoint('latest')
+    checkpoint_pool.shutdown(wait=True) # Make sure the final save hits the disk
 elif args.evaluate and not args.export_sample:
     # FID evaluation mode
     
     if args.which_epoch == 'best':
-        import re
-        
         best_fid = float('inf')
         best_checkpoint = None
-        
-        checkpoints = {}
-        # Run search on all checkpoints and select best FID
-        chk_paths = sorted(glob.glob(os.path.join(checkpoint_dir, f'checkpoint_[0-9]*.pth')))
-        for path in chk_paths:
-            chk_epoch = re.search('checkpoint_([0-9]+).pth', path)
-            if chk_epoch:
-                checkpoints[int(chk_epoch.group(1))] = path
-            else:
-                raise ValueError(f'Invalid path detected: {path}')
-        
+
+        # Run search on all numbered checkpoints and select best FID
+        checkpoints = []
+        with os.scandir(checkpoint_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith('checkpoint_') and name.endswith('.pth') and name[11:-4].isdigit():
+                    checkpoints.append((int(name[11:-4]), entry.path))
+        checkpoints.sort(reverse=True)
+
         print('Enumerating checkpoints:')
-        checkpoints = sorted(checkpoints.items())[::-1]
         for chk_epoch, path in checkpoints:
             print(f'Epoch {chk_epoch}: {path}')
         
@@ -924,7 +1270,9 @@ elif args.evaluate and not args.export_sample:
             sys.exit(1)
         
         def load_checkpoint(path):
-            chk = torch.load(path, map_location=lambda storage, loc: storage)
+            # Memory-map the file: only the two generator state dicts are read,
+            # so the optimizer/discriminator tensors never get paged in
+            chk = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
             generator_running_avg.load_state_dict(chk['generator_running_avg'])
             generator.load_state_dict(chk['generator'])
         
@@ -955,9 +1303,17 @@ elif args.export_sample:
     if args.how_many == -1:
         args.how_many = args.batch_size
     print(f'Exporting sample of {args.how_many} objects')
-    with torch.no_grad():
+    # inference_mode also skips the version-counter bookkeeping that no_grad keeps
+    with torch.inference_mode():
         num_passes = args.how_many // args.batch_size
-        exported_images = []
+        exported_images = None # Pinned staging buffer, allocated on the first pass
+        # The pose arrays are indexed on every pass: keep a GPU-resident copy
+        # instead of gathering on the CPU and re-uploading each time
+        pose_gpu = {k: train_ds.data[k].cuda() for k in ('rotation', 'scale', 'translation')}
+        # The .obj/.npy writes run on background threads, overlapping the
+        # filesystem I/O with the generation of the next batch
+        export_pool = ThreadPoolExecutor(max_workers=4)
+        export_futures = []
         for i_pass in tqdm(range(num_passes)):
             indices = np.random.choice(len(train_ds), size=args.batch_size, replace=False)
             if args.conditional_class or args.conditional_text:
@@ -968,71 +1324,83 @@ elif args.export_sample:
                     caption = None
                 elif args.conditional_text:
                     c = None
-                    caps = []
-                    cap_lengths = []
-                    for i in indices:
-                        cap, cap_length = train_ds.get_random_caption(i)
-                        caps.append(cap)
-                        cap_lengths.append(cap_length)
-                    caption = (torch.LongTensor(caps).cuda(), torch.LongTensor(cap_lengths).cuda())
+                    # Stack once on the host and upload in a single copy, instead of
+                    # building a LongTensor out of a Python list of per-sample arrays
+                    caps, cap_lengths = zip(*(train_ds.get_random_caption(i) for i in indices))
+                    caption = (torch.from_numpy(np.stack(caps)).cuda(non_blocking=True),
+                               torch.as_tensor(cap_lengths).cuda(non_blocking=True))
             else:
                 c, caption = None, None
 
             if args.conditional_semantics:
-                seg = []
-                for i in indices:
-                    seg.append(train_ds[i]['seg'])
-                seg = torch.stack(seg, dim=0)
+                seg = train_ds.get_segs(indices).cuda()
             else:
                 seg = None
 
 
-            noise = torch.randn(args.batch_size, args.latent_dim)
-
-            # Gaussian truncation trick
-            sigma = args.truncation_sigma
-            while (noise.abs() > sigma).any():
-                # Rejection sampling
-                mask = noise.abs() > sigma
-                noise[mask] = torch.randn_like(noise[mask])
+            # Gaussian truncation trick (single inverse-CDF kernel, directly on the GPU)
+            noise = truncated_normal((args.batch_size, args.latent_dim), args.truncation_sigma, device='cuda')
 
             generator_running_avg.eval()
-            noise = noise.cuda()
-            pred_tex, pred_mesh_map, pred_seg, attn_map = trainer('inference', None, None, C=c, caption=caption, seg=seg, noise=noise)
-            
+            # No scaler needed at inference time, autocast alone is enough
+            with torch.autocast('cuda', dtype=torch.float16):
+                pred_tex, pred_mesh_map, pred_seg, attn_map = trainer('inference', None, None, C=c, caption=caption, seg=seg, noise=noise)
+            pred_tex = pred_tex.float()
+            pred_mesh_map = pred_mesh_map.float()
+
             vtx = mesh_template.get_vertex_positions(pred_mesh_map)
             vtx_obj = vtx.clone()
             vtx_obj[..., :] = vtx_obj[..., [0, 2, 1]] # Swap Y and Z (the result is Y up)
             output_dir = os.path.join('output', args.name)
             pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
-            for i, v in enumerate(vtx_obj):
+            # One batched normalization/argmax and one D2H copy per pass,
+            # instead of one per exported sample
+            vtx_cpu = vtx_obj.cpu()
+            tex_cpu = (pred_tex/2 + 0.5).cpu()
+            if args.predict_semantics:
+                seg_cpu = pred_seg.argmax(dim=1).cpu().numpy()
+            for i in range(vtx_cpu.shape[0]):
                 j = i + i_pass * args.batch_size
                 mesh_name = f'mesh_{j:0>6d}'
-                mesh_template.export_obj(os.path.join(output_dir, f'{mesh_name}'), v, pred_tex[i]/2 + 0.5)
-            
+                export_futures.append(export_pool.submit(mesh_template.export_obj,
+                                      os.path.join(output_dir, f'{mesh_name}'), vtx_cpu[i], tex_cpu[i]))
+
                 # Export segmentation maps
                 if args.predict_semantics:
-                    seg_obj = np.array(pred_seg[i].argmax(dim=0).cpu())
-                    np.save(os.path.join(output_dir, f'{mesh_name}_seg.npy'), seg_obj)
+                    export_futures.append(export_pool.submit(np.save,
+                                          os.path.join(output_dir, f'{mesh_name}_seg.npy'), seg_cpu[i]))
             
-            rotation = train_ds.data['rotation'][indices].cuda()
-            scale = train_ds.data['scale'][indices].cuda()
-            translation = train_ds.data['translation'][indices].cuda()
+            indices_dev = torch.as_tensor(indices, device='cuda')
+            rotation = pose_gpu['rotation'][indices_dev]
+            scale = pose_gpu['scale'][indices_dev]
+            translation = pose_gpu['translation'][indices_dev]
 
             vtx = qrot(rotation, scale.unsqueeze(-1)*vtx) + translation.unsqueeze(1)
-            vtx = vtx * torch.Tensor([1, -1, -1]).to(vtx.device)
+            vtx = vtx * axis_flip
 
             image_pred, alpha_pred = mesh_template.forward_renderer(renderer, vtx, pred_tex,
-                                                                    num_gpus=len(gpu_ids),
                                                                     return_hardmask=True)
-            image_pred[alpha_pred.expand_as(image_pred) == 0] = 1
-            image_pred = image_pred.permute(0, 3, 1, 2)/2 + 0.5
-            image_pred = torch.cat((image_pred, alpha_pred.permute(0, 3, 1, 2)), dim=1) # Add alpha channel
+            # White background through a broadcast select: no materialized boolean
+            # mask or scatter, and the output normalization is fused into the same
+            # expression (the background ends up at 1 either way)
+            image_pred = torch.where(alpha_pred == 0,
+                                     torch.ones((), device=image_pred.device, dtype=image_pred.dtype),
+                                     image_pred/2 + 0.5)
+            image_pred = torch.cat((image_pred, alpha_pred), dim=1) # Add alpha channel
             image_pred = F.avg_pool2d(image_pred, 4) # Anti-aliasing
-            exported_images.append(image_pred.cpu())
+            if exported_images is None:
+                # One pinned host buffer for the whole sweep: each pass copies its
+                # images asynchronously into their final slot, so the D2H transfer
+                # overlaps with the next pass and no torch.cat is needed at the end
+                exported_images = torch.empty(num_passes*args.batch_size, *image_pred.shape[1:],
+                                              pin_memory=True)
+            exported_images[i_pass*args.batch_size:(i_pass+1)*args.batch_size].copy_(image_pred, non_blocking=True)
 
         print('Saving...')
-        exported_images = torch.cat(exported_images, dim=0)
+        torch.cuda.synchronize() # Wait for the asynchronous image copies
+        for future in export_futures:
+            future.result() # Propagate any I/O error
+        export_pool.shutdown()
         import imageio
         import torchvision
         image_grid = torchvision.utils.make_grid(exported_images, nrow=8, padding=0)
@@ -4,20 +4,65 @@ from packaging import version
 import scipy
 
 from .inception import InceptionV3
+import torch
 import torch.nn.functional as F
 
 class RepeatIterator:
     def __init__(self, iterator, n):
         self.iterator = iterator
         self.n = n
-        
+
     def __iter__(self):
         for _ in range(self.n):
             yield from self.iterator
-            
+
     def __len__(self):
         return len(self.iterator) * self.n
 
+class PrefetchLoader:
+    """
+    Wraps a data loader that yields dicts of (tuples of) CPU tensors, and uploads
+    each batch to the GPU on a side stream while the previous batch is being consumed.
+    This hides the H2D copy latency behind GPU compute (requires pinned memory).
+    """
+    def __init__(self, loader):
+        self.loader = loader
+        self.stream = torch.cuda.Stream()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _upload(self, data):
+        def to_gpu(v):
+            if torch.is_tensor(v):
+                return v.cuda(non_blocking=True)
+            elif isinstance(v, (tuple, list)):
+                return type(v)(to_gpu(x) for x in v)
+            else:
+                return v
+        with torch.cuda.stream(self.stream):
+            return {k: to_gpu(v) for k, v in data.items()}
+
+    def _sync(self, data):
+        # Hand the prefetched tensors over to the main stream
+        torch.cuda.current_stream().wait_stream(self.stream)
+        for v in data.values():
+            for x in (v if isinstance(v, (tuple, list)) else [v]):
+                if torch.is_tensor(x):
+                    x.record_stream(torch.cuda.current_stream())
+        return data
+
+    def __iter__(self):
+        prefetched = None
+        for data in self.loader:
+            next_data = self._upload(data)
+            if prefetched is not None:
+                yield self._sync(prefetched)
+            prefetched = next_data
+        if prefetched is not None:
+            yield self._sync(prefetched)
+
+
 def init_inception():
     block_dim = 2048
     block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[block_dim]
@@ -30,16 +75,57 @@ def init_inception():
     return inception_model
 
 def forward_inception_batch(inception_model, images):
-    pred = inception_model(images)[0]
+    # FP16 autocast (with channels-last inputs) enables Tensor Cores; the final
+    # embeddings are pooled, so FID statistics are unaffected by the lower precision
+    with torch.autocast('cuda', dtype=torch.float16):
+        pred = inception_model(images)[0]
     if pred.shape[2] != 1 or pred.shape[3] != 1:
         pred = F.adaptive_avg_pool2d(pred, output_size=(1, 1))
-    return pred.data.cpu().numpy().reshape(images.shape[0], -1)
+    return pred.data.float().cpu().numpy().reshape(images.shape[0], -1)
 
 def calculate_stats(act):
     mu = np.mean(act, axis=0)
     sigma = np.cov(act, rowvar=False)
     return mu, sigma
 
+class OnlineStats:
+    """
+    Streaming mean/covariance accumulator (batched Welford update).
+    Computes the same statistics as calculate_stats, but in O(1) memory
+    w.r.t. the number of samples (no need to keep all embeddings around).
+    """
+    def __init__(self, dim=2048):
+        self.n = 0
+        self.mean = np.zeros(dim, dtype=np.float64)
+        self.M2 = np.zeros((dim, dim), dtype=np.float64)
+
+    def update(self, batch):
+        batch = batch.astype(np.float64, copy=False)
+        self.n += batch.shape[0]
+        delta = batch - self.mean
+        self.mean += delta.sum(axis=0) / self.n
+        self.M2 += delta.T @ (batch - self.mean)
+
+    def merge(self, other):
+        # Parallel combination of two accumulators (Chan et al.),
+        # used to merge the shards computed by different processes
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n = other.n
+            self.mean = other.mean.copy()
+            self.M2 = other.M2.copy()
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.M2 += other.M2 + np.outer(delta, delta) * self.n * other.n / n
+        self.mean += delta * other.n / n
+        self.n = n
+
+    def get_stats(self):
+        assert self.n > 1, 'Not enough samples to estimate a covariance'
+        return self.mean, self.M2 / (self.n - 1)
+
 # Borrowed from https://github.com/mseitzer/pytorch-fid
 def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
     """Numpy implementation of the Frechet Distance.